@@ -1,30 +1,115 @@
+import collections
+import functools
+import itertools
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
 
 import dotenv
 import eth_typing
-
-import spec
-import trade_processing
+import orjson
+import requests
+from requests import adapters
 
 dotenv.load_dotenv()
 import logging
 
 from crypto_utils import exceptions
 from crypto_utils import exceptions as utils_exceptions
-from crypto_utils import http_utils, price, w3
+from crypto_utils import price, w3
 from crypto_utils.config import config
 from web3 import Web3
 from web3 import exceptions as web3_exceptions
 
-from src import schemas
+from src import erc20_metadata_cache, schemas, spec, trade_processing
 
 log = logging.getLogger(__name__)
+T = TypeVar("T")
 
 COVALENT_API_KEY = config.COVALENT_KEY
 COVALENT_URL = "https://api.covalenthq.com/v1/1"
 ETH_CHAIN_ID = 1
+MAX_PAGE_SIZE = 1000
+# Covalent page numbers start at 0
+FIRST_PAGE = 0
+# Covalent rate limits concurrent requests per key
+MAX_CONCURRENT_PAGE_REQUESTS = 8
+# extraction of a transaction is dominated by blocking RPC calls
+MAX_CONCURRENT_TRANSACTION_EXTRACTIONS = 16
+COVALENT_REQUEST_TIMEOUT_S = 60
+# pages fetched ahead while the current one is being extracted
+PREFETCHED_PAGES = 2
+# ERC20 decimals are uint8, dividing by float(10**i) matches dividing by the int
+_POW10 = [float(10**decimals) for decimals in range(256)]
+EXTRACTED_EVENT_NAMES = frozenset({"Transfer", "Deposit", "Withdrawal"})
+
+# reuse connections to Covalent instead of a new TLS handshake per page
+_covalent_session = requests.Session()
+_covalent_session.mount(
+    "https://",
+    adapters.HTTPAdapter(
+        pool_connections=MAX_CONCURRENT_PAGE_REQUESTS,
+        pool_maxsize=MAX_CONCURRENT_PAGE_REQUESTS,
+    ),
+)
+
+
+_erc20_metadata_cache = erc20_metadata_cache.Erc20MetadataCache()
+
+
+# the same token contracts emit most logs, don't keccak their address every time
+@functools.lru_cache(maxsize=8192)
+def _to_checksum_address(address: str) -> eth_typing.ChecksumAddress:
+    return Web3.toChecksumAddress(address)
+
+
+# ERC20 metadata is immutable, cache it for the whole run and on disk
+@functools.lru_cache(maxsize=8192)
+def _get_erc20_info(
+    token_address: eth_typing.ChecksumAddress,
+) -> schemas.Erc20Metadata:
+    metadata = _erc20_metadata_cache.get(token_address)
+    if metadata is None:
+        token_info = w3.get_erc20_info(token_address)
+        metadata = schemas.Erc20Metadata(
+            symbol=token_info.symbol, decimals=token_info.decimals
+        )
+        _erc20_metadata_cache.set(token_address, metadata)
+    return metadata
+
+
+def _prime_erc20_metadata(tx_items: list[dict[str, Any]]) -> None:
+    """
+    Covalent log events already carry decimals and ticker of the emitting
+    contract, store them so extraction doesn't need RPC calls for them
+    """
+    metadata_by_address: dict[str, schemas.Erc20Metadata] = {}
+    for item in tx_items:
+        for log_event in item["log_events"]:
+            decoded = log_event["decoded"]
+            if not decoded or decoded["name"] not in EXTRACTED_EVENT_NAMES:
+                # senders of Swap, Sync, Approval... logs are never looked up
+                continue
+            decimals = log_event.get("sender_contract_decimals")
+            symbol = log_event.get("sender_contract_ticker_symbol")
+            if decimals is None or not symbol:
+                continue
+            metadata_by_address[
+                log_event["sender_address"].lower()
+            ] = schemas.Erc20Metadata(symbol=symbol, decimals=decimals)
+    _erc20_metadata_cache.set_missing(
+        (_to_checksum_address(address), metadata)
+        for address, metadata in metadata_by_address.items()
+    )
+
+
+def _parse_block_signed_at(block_signed_at: str) -> datetime:
+    # naive datetime like strptime would give, fromisoformat is much faster
+    return datetime.fromisoformat(block_signed_at.removesuffix("Z"))
 
 
 def _extract_swapped_token(erc20_token: schemas.Erc20Info) -> schemas.TradedToken:
@@ -41,20 +126,13 @@ def _extract_swapped_token(erc20_token: schemas.Erc20Info) -> schemas.TradedToke
 def _extract_transfer_params(
     params: list[dict[str, Any]]
 ) -> tuple[Optional[str], Optional[str], Optional[float]]:
-    address_from = None
-    address_to = None
-    transferred_value = None
-    for param in params:
-        name = param["name"]
-        value = param["value"]
-        match name:
-            case "from":
-                address_from = value
-            case "to":
-                address_to = value
-            case "value":
-                transferred_value = float(value)
-    return address_from, address_to, transferred_value
+    params_by_name = {param["name"]: param["value"] for param in params}
+    transferred_value = params_by_name.get("value")
+    return (
+        params_by_name.get("from"),
+        params_by_name.get("to"),
+        float(transferred_value) if transferred_value is not None else None,
+    )
 
 
 @dataclass
@@ -65,6 +143,37 @@ class SingleTransactionsMoves:
     withdrawals: list[schemas.Erc20Info]
 
 
+@dataclass(slots=True, frozen=True)
+class _PrefetchFailure:
+    error: Exception
+
+
+_PREFETCH_DONE = object()
+
+
+def _prefetch(items: Iterable[T], max_prefetched: int) -> Iterator[T]:
+    """
+    Produces items on a background thread so producing the next items overlaps
+    with consuming the current one, errors are re-raised in the consumer
+    """
+    prefetched: queue.Queue[Any] = queue.Queue(maxsize=max_prefetched)
+
+    def produce() -> None:
+        try:
+            for item in items:
+                prefetched.put(item)
+        except Exception as error:
+            prefetched.put(_PrefetchFailure(error))
+        else:
+            prefetched.put(_PREFETCH_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (item := prefetched.get()) is not _PREFETCH_DONE:
+        if isinstance(item, _PrefetchFailure):
+            raise item.error
+        yield item
+
+
 class Covalent:
     def __init__(
         self,
@@ -73,10 +182,13 @@ class Covalent:
     ):
         self._cex_price_provider = cex_price_provider
         self._transaction_price_provider = transaction_price_provider
+        self._cex_prices: dict[tuple[str, datetime], float] = {}
 
     @staticmethod
     def request_transactions(
-        address: eth_typing.ChecksumAddress, page_size: int = 10, page: int = 1
+        address: eth_typing.ChecksumAddress,
+        page_size: int = 10,
+        page: int = FIRST_PAGE,
     ) -> Any:
         url = f"{COVALENT_URL}/address/{address}/transactions_v2/"
         params = {
@@ -88,8 +200,75 @@ class Covalent:
             "page-size": page_size,
             "key": COVALENT_API_KEY,
         }
-        transactions_json = http_utils.request(url, params)
-        return transactions_json
+        response = _covalent_session.get(
+            url, params=params, timeout=COVALENT_REQUEST_TIMEOUT_S
+        )
+        response.raise_for_status()
+        # pages with logs are large, orjson decodes them several times faster
+        return orjson.loads(response.content)
+
+    @classmethod
+    def request_transactions_pages(
+        cls,
+        address: eth_typing.ChecksumAddress,
+        pages: Iterable[int],
+        page_size: int = 10,
+    ) -> Iterator[Any]:
+        pages_to_request = iter(pages)
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGE_REQUESTS) as executor:
+            # only a window of pages is requested ahead of the consumer
+            requested_pages = collections.deque(
+                executor.submit(cls.request_transactions, address, page_size, page)
+                for page in itertools.islice(
+                    pages_to_request, MAX_CONCURRENT_PAGE_REQUESTS
+                )
+            )
+            while requested_pages:
+                transactions_json = requested_pages.popleft().result()
+                next_page = next(pages_to_request, None)
+                if next_page is not None:
+                    requested_pages.append(
+                        executor.submit(
+                            cls.request_transactions, address, page_size, next_page
+                        )
+                    )
+                yield transactions_json
+
+    @classmethod
+    def request_all_transactions(
+        cls,
+        address: eth_typing.ChecksumAddress,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> Iterator[Any]:
+        """
+        Yields pages of transactions of address in block order, pages without
+        any transactions are not yielded
+        """
+        transactions_json = cls.request_transactions(address, page_size, FIRST_PAGE)
+        if not transactions_json["data"]["items"]:
+            return
+        yield transactions_json
+        pagination = transactions_json["data"]["pagination"]
+        total_count = pagination.get("total_count")
+        if pagination["has_more"] and total_count:
+            # page count is known, request the rest at once
+            pages = range(
+                FIRST_PAGE + 1, FIRST_PAGE + math.ceil(total_count / page_size)
+            )
+            for transactions_json in cls.request_transactions_pages(
+                address, pages, page_size
+            ):
+                if transactions_json["data"]["items"]:
+                    yield transactions_json
+            return
+        page = FIRST_PAGE
+        while pagination["has_more"]:
+            page += 1
+            transactions_json = cls.request_transactions(address, page_size, page)
+            if not transactions_json["data"]["items"]:
+                return
+            yield transactions_json
+            pagination = transactions_json["data"]["pagination"]
 
     @staticmethod
     def _extract_token_swap(
@@ -97,32 +276,25 @@ class Covalent:
         block_time: datetime,
         transaction_hash: str,
     ) -> schemas.TokenSwap | None:
-        sold_tokens: list[schemas.TradedToken] = []
-        bought_tokens: list[schemas.TradedToken] = []
-        usd_paid = 0.0
-        usd_received = 0.0
-        for sent_transfer in single_transaction_moves.sent_transfers:
-            sold_token = _extract_swapped_token(sent_transfer)
-            usd_paid += sold_token.value_usd
-            sold_tokens.append(sold_token)
-        for received_transfer in single_transaction_moves.received_transfers:
-            bought_token = _extract_swapped_token(received_transfer)
-            usd_received += bought_token.value_usd
-            bought_tokens.append(bought_token)
-        for deposit in single_transaction_moves.deposits:
-            usd_paid += deposit.value_usd
-            sold_token = _extract_swapped_token(deposit)
-            sold_tokens.append(sold_token)
-        for withdrawal in single_transaction_moves.withdrawals:
-            usd_received += withdrawal.value_usd
-            bought_token = _extract_swapped_token(withdrawal)
-            bought_tokens.append(bought_token)
-
-        block_datetime = block_time
+        sold_moves: list[schemas.Erc20Info] = [
+            *single_transaction_moves.sent_transfers,
+            *single_transaction_moves.deposits,
+        ]
+        usd_paid = sum((sold_move.value_usd for sold_move in sold_moves), 0.0)
         if not usd_paid:
+            # nothing was paid, don't create traded tokens for a non swap
             return None
+        bought_moves: list[schemas.Erc20Info] = [
+            *single_transaction_moves.received_transfers,
+            *single_transaction_moves.withdrawals,
+        ]
+        usd_received = sum((bought_move.value_usd for bought_move in bought_moves), 0.0)
+        sold_tokens = [_extract_swapped_token(sold_move) for sold_move in sold_moves]
+        bought_tokens = [
+            _extract_swapped_token(bought_move) for bought_move in bought_moves
+        ]
         return schemas.TokenSwap(
-            block_datetime,
+            block_time,
             usd_paid,
             usd_received,
             sold_tokens,
@@ -132,33 +304,33 @@ class Covalent:
 
     @staticmethod
     def _extract_transfer(
-        trader_address: eth_typing.ChecksumAddress,
+        trader_address_lower: str,
         decoded: dict[str, Any],
         token_address: eth_typing.ChecksumAddress,
         transaction_usd_value: float,
     ) -> schemas.Erc20Transfer | None:
         params = decoded["params"]
         address_from, address_to, transferred_value = _extract_transfer_params(params)
-        if not all([address_from, address_to, transferred_value]):
+        if not address_from or not address_to or not transferred_value:
             raise exceptions.MissingDataError()
-        trader_sender = address_from.lower() == trader_address.lower()  # type: ignore
-        trader_receiver = address_to.lower() == trader_address.lower()  # type: ignore
+        trader_sender = address_from.lower() == trader_address_lower
+        trader_receiver = address_to.lower() == trader_address_lower
         if (not trader_receiver) and (not trader_sender):
             # we can have transfer that is from other contract to other contract
             return None
         is_trader_sender = False
         if trader_sender and not trader_receiver:
             is_trader_sender = True
-        token_info = w3.get_erc20_info(token_address)
+        token_info = _get_erc20_info(token_address)
         token_decimals = token_info.decimals
-        token_value_divided = transferred_value / 10**token_decimals
+        token_value_divided = transferred_value / _POW10[token_decimals]
         try:
             token_price = transaction_usd_value / token_value_divided
         except exceptions.CantFindTokenPriceError as e:
             log.warning(e)
             return None
         except exceptions.MissingDataError as missing_data_error:
-            log.warning(f"Missing transfer data, skipping swap {missing_data_error}")
+            log.warning("Missing transfer data, skipping swap %s", missing_data_error)
             return None
         token_value_usd = token_price * token_value_divided
         return schemas.Erc20Transfer(
@@ -169,6 +341,18 @@ class Covalent:
             symbol=token_info.symbol,
         )
 
+    def _get_cex_price(self, symbol: str, at_time: datetime) -> float:
+        # prices are cached per minute, transactions in the same minute share them
+        price_minute = at_time.replace(second=0, microsecond=0)
+        price_key = (symbol, price_minute)
+        price = self._cex_prices.get(price_key)
+        if price is None:
+            price = self._cex_price_provider.get_price_of_token(
+                symbol=symbol, at_time=price_minute
+            )
+            self._cex_prices[price_key] = price
+        return price
+
     def _extract_deposit_or_withdraw(
         self,
         decoded: dict[Any, Any],
@@ -180,20 +364,14 @@ class Covalent:
         params = decoded["params"]
         if not params:
             return None
-        value_deposited = None
-        for param in params:
-            name = param["name"]
-            value = param["value"]
-            if name == "wad":
-                value_deposited = value
-                break
+        value_deposited = next(
+            (param["value"] for param in params if param["name"] == "wad"), None
+        )
         if not value_deposited:
             raise exceptions.MissingDataError()
-        coin_info = w3.get_erc20_info(token_address)
-        value_divided = float(value_deposited) / 10**coin_info.decimals
-        price = self._cex_price_provider.get_price_of_token(
-            symbol="ETH", at_time=block_time
-        )
+        coin_info = _get_erc20_info(token_address)
+        value_divided = float(value_deposited) / _POW10[coin_info.decimals]
+        price = self._get_cex_price(symbol="ETH", at_time=block_time)
         value_usd = value_divided * price
         erc20_move = schemas.Erc20Info(
             token_address=token_address,
@@ -206,22 +384,30 @@ class Covalent:
         else:
             single_transaction_moves.withdrawals.append(erc20_move)
 
+    def _get_transaction_usd_value(
+        self, tx_hash: eth_typing.ChecksumAddress
+    ) -> float | None:
+        try:
+            transaction_usd_value: float = (
+                self._transaction_price_provider.get_usd_value_of_transaction(tx_hash)
+            )
+        except utils_exceptions.CantExtractUsdValueError:
+            return None
+        return transaction_usd_value
+
     def _extract_single_transfer(
         self,
-        tx_hash: eth_typing.ChecksumAddress,
-        trader_address: eth_typing.ChecksumAddress,
+        get_transaction_usd_value: Callable[[], float | None],
+        trader_address_lower: str,
         decoded: dict[str, Any],
         token_address: eth_typing.ChecksumAddress,
         single_transaction_moves: SingleTransactionsMoves,
     ) -> None:
-        try:
-            transaction_usd_value = (
-                self._transaction_price_provider.get_usd_value_of_transaction(tx_hash)
-            )
-        except utils_exceptions.CantExtractUsdValueError:
+        transaction_usd_value = get_transaction_usd_value()
+        if transaction_usd_value is None:
             return None
         transfer = self._extract_transfer(
-            trader_address, decoded, token_address, transaction_usd_value
+            trader_address_lower, decoded, token_address, transaction_usd_value
         )
         if transfer:
             if transfer.trader_sender:
@@ -234,16 +420,19 @@ class Covalent:
         block_time: datetime,
         log_event: dict[str, Any],
         single_transaction_moves: SingleTransactionsMoves,
-        trader_address: eth_typing.ChecksumAddress,
-        tx_hash: eth_typing.ChecksumAddress,
+        trader_address_lower: str,
+        get_transaction_usd_value: Callable[[], float | None],
     ) -> None:
         decoded = log_event["decoded"]
         event_name = decoded["name"]
-        token_address = Web3.toChecksumAddress(log_event["sender_address"])
+        if event_name not in EXTRACTED_EVENT_NAMES:
+            # Swap, Sync, Approval... logs are not needed, skip the checksum hashing
+            return None
+        token_address = _to_checksum_address(log_event["sender_address"])
         if event_name == "Transfer":
             self._extract_single_transfer(
-                tx_hash,
-                trader_address,
+                get_transaction_usd_value,
+                trader_address_lower,
                 decoded,
                 token_address,
                 single_transaction_moves,
@@ -271,15 +460,25 @@ class Covalent:
         trader_address: spec.Address,
     ) -> schemas.TokenSwap | None:
         log_events = item["log_events"]
-        block_time = datetime.strptime(item["block_signed_at"], "%Y-%m-%dT%H:%M:%SZ")
+        block_time = _parse_block_signed_at(item["block_signed_at"])
         tx_hash = item["tx_hash"]
         single_transaction_moves = SingleTransactionsMoves([], [], [], [])
+        # usd value is the same for every transfer in the transaction,
+        # look it up on the first transfer only, most transactions have none
+        get_transaction_usd_value = functools.cache(
+            functools.partial(self._get_transaction_usd_value, tx_hash)
+        )
+        trader_address_lower = trader_address.lower()
         for log_event in log_events:
             decoded = log_event["decoded"]
             if not decoded:
                 return None
             self._extract_single_log(
-                block_time, log_event, single_transaction_moves, trader_address, tx_hash
+                block_time,
+                log_event,
+                single_transaction_moves,
+                trader_address_lower,
+                get_transaction_usd_value,
             )
         return self._extract_token_swap(
             single_transaction_moves,
@@ -287,34 +486,50 @@ class Covalent:
             tx_hash,
         )
 
+    def _try_extract_single_transaction_swap(
+        self,
+        item: dict[str, Any],
+        trader_address: eth_typing.ChecksumAddress,
+    ) -> schemas.TokenSwap | None:
+        try:
+            return self.extract_single_transaction_swap(item, trader_address)
+        except exceptions.CantFindTokenPriceError:
+            log.warning(
+                "Could not extract price for trade, ignoring swap %s", item["tx_hash"]
+            )
+        except exceptions.MissingDataError as missing_data_error:
+            log.warning(
+                "There is missing data error %s, ignoring item: %s",
+                missing_data_error,
+                item["tx_hash"],
+            )
+        except web3_exceptions.ContractLogicError:
+            log.warning("Contract call reverted, ignoring item: %s", item["tx_hash"])
+        return None
+
     def _extract_token_swaps(
         self,
         tx_json: dict[str, Any],
         trader_address: eth_typing.ChecksumAddress,
     ) -> list[schemas.TokenSwap]:
-        token_swaps: list[schemas.TokenSwap] = []
         tx_data = tx_json["data"]
         if not tx_data:
             raise exceptions.MissingDataError()
         tx_items = tx_data["items"]
         if not tx_items:
             raise exceptions.MissingDataError()
-        for item in tx_items:
-            try:
-                token_swap = self.extract_single_transaction_swap(item, trader_address)
-                if token_swap:
-                    token_swaps.append(token_swap)
-            except exceptions.CantFindTokenPriceError:
-                log.warning(f"Could not extract price for trade, ignoring swap {item}")
-            except exceptions.MissingDataError as missing_data_error:
-                log.warning(
-                    f"There is missing data error {missing_data_error},"
-                    f" ignoring item: {item}"
-                )
-            except web3_exceptions.ContractLogicError:
-                log.warning(f"Contract call reverted, ignoring item: {item}")
-
-        return token_swaps
+        _prime_erc20_metadata(tx_items)
+        with ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_TRANSACTION_EXTRACTIONS
+        ) as executor:
+            # map keeps the block order of the items, trades are processed in order
+            token_swaps = executor.map(
+                lambda item: self._try_extract_single_transaction_swap(
+                    item, trader_address
+                ),
+                tx_items,
+            )
+            return [token_swap for token_swap in token_swaps if token_swap]
 
 
 if __name__ == "__main__":
@@ -332,8 +547,10 @@ if __name__ == "__main__":
     cov = Covalent(
         price.BinancePriceProvider(), price.UniswapTransactionValueUsdProvider()
     )
-    for page in range(1, 15):
-        transactions_json = cov.request_transactions(address, page_size=50, page=page)
+    transactions_pages = _prefetch(
+        cov.request_all_transactions(address), PREFETCHED_PAGES
+    )
+    for transactions_json in transactions_pages:
         token_swaps = cov._extract_token_swaps(transactions_json, address)
-        [trade_profit_calculator.receive_token_swap(swap) for swap in token_swaps]
+        trade_profit_calculator.receive_token_swaps(token_swaps)
     [print(a) for a in trade_profit_calculator.finished_trades]
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+from typing import Iterable
+
+import eth_typing
+
+from src import schemas
+
+ERC20_METADATA_CACHE_PATH = "erc20_metadata_cache.sqlite3"
+
+
+class Erc20MetadataCache:
+    """
+    Persistent cache of ERC20 metadata, symbol and decimals of a deployed token
+    never change so they can be kept between runs
+    """
+
+    def __init__(self, path: str = ERC20_METADATA_CACHE_PATH) -> None:
+        self._path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS erc20_metadata ("
+                "address TEXT PRIMARY KEY, symbol TEXT NOT NULL, "
+                "decimals INTEGER NOT NULL)"
+            )
+        return self._connection
+
+    def get(
+        self, token_address: eth_typing.ChecksumAddress
+    ) -> schemas.Erc20Metadata | None:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT symbol, decimals FROM erc20_metadata WHERE address = ?",
+                    (token_address,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        symbol, decimals = row
+        return schemas.Erc20Metadata(symbol=symbol, decimals=decimals)
+
+    def set(
+        self,
+        token_address: eth_typing.ChecksumAddress,
+        metadata: schemas.Erc20Metadata,
+    ) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO erc20_metadata VALUES (?, ?, ?)",
+                    (token_address, metadata.symbol, metadata.decimals),
+                )
+
+    def set_missing(
+        self,
+        token_metadata: Iterable[
+            tuple[eth_typing.ChecksumAddress, schemas.Erc20Metadata]
+        ],
+    ) -> None:
+        rows = [
+            (token_address, metadata.symbol, metadata.decimals)
+            for token_address, metadata in token_metadata
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO erc20_metadata VALUES (?, ?, ?)", rows
+                )
@@ -1,16 +1,22 @@
+import sys
 from dataclasses import dataclass
 from datetime import datetime
+from typing import cast
 
 import eth_typing
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     address: eth_typing.ChecksumAddress
     symbol: str
 
+    def __post_init__(self) -> None:
+        # addresses are dict keys of open positions, equal ones share one object
+        self.address = cast(eth_typing.ChecksumAddress, sys.intern(self.address))
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class Erc20Info:
     token_address: eth_typing.ChecksumAddress
     value: float
@@ -18,19 +24,19 @@ class Erc20Info:
     symbol: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Erc20Transfer(Erc20Info):
     trader_sender: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class TradedToken(Token):
     amount: float
     value_usd: float
     price_usd: float
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TokenSwap:
     time: datetime
     usd_paid: float
@@ -40,7 +46,7 @@ class TokenSwap:
     transaction_hash: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SingleTokenBuy:
     buy_time: datetime
     buy_price_usd: float
@@ -50,7 +56,7 @@ class SingleTokenBuy:
     token_bought: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class BoughtToken:
     token_bought: Token
     currently_held_amount: float
@@ -58,7 +64,7 @@ class BoughtToken:
     single_token_buys: list[SingleTokenBuy]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FinishedTrade:
     token_bought: Token
     amount: float
@@ -69,3 +75,9 @@ class FinishedTrade:
     profit_usd: float
     sell_time: datetime
     sell_transaction: str
+
+
+@dataclass(slots=True, frozen=True)
+class Erc20Metadata:
+    symbol: str
+    decimals: int
@@ -1,12 +1,13 @@
-import dataclasses
+import bisect
 import logging
 from abc import ABC, abstractmethod
+from typing import Iterable
 
-from src import exceptions, schemas
+from src import schemas
 
 log = logging.getLogger(__name__)
 DIFF_DIVIDER = 10.0
-IGNORED_BUY_TOKEN_SYMBOLS = ["WETH", "USDT", "USDC", "DAI", "RAI"]
+IGNORED_BUY_TOKEN_SYMBOLS = frozenset({"WETH", "USDT", "USDC", "DAI", "RAI"})
 
 
 class TokenSwapProcessor(ABC):
@@ -14,6 +15,12 @@ class TokenSwapProcessor(ABC):
     def receive_token_swap(self, trade: schemas.TokenSwap) -> None:
         pass
 
+    def receive_token_swaps(self, trades: Iterable[schemas.TokenSwap]) -> None:
+        # swaps depend on positions left by previous ones, keep them in order
+        receive_token_swap = self.receive_token_swap
+        for trade in trades:
+            receive_token_swap(trade)
+
 
 class TraderProfitCalculator(TokenSwapProcessor):
     def __init__(self) -> None:
@@ -21,7 +28,20 @@ class TraderProfitCalculator(TokenSwapProcessor):
         self._bought_tokens: dict[str, schemas.BoughtToken] = {}
 
     @staticmethod
+    def _calculate_trade_values(
+        amount: float, buy_price_usd: float, sell_price_usd: float
+    ) -> tuple[float, float, float]:
+        """
+        :return: buy value, sell value and profit of the traded amount in usd
+        """
+        buy_value_usd = amount * buy_price_usd
+        sell_value_usd = amount * sell_price_usd
+        profit_usd = sell_value_usd - buy_value_usd  # TODO add fees
+        return buy_value_usd, sell_value_usd, profit_usd
+
+    @classmethod
     def _create_finished_trade(
+        cls,
         open_trade: schemas.BoughtToken,
         token_sold: schemas.TradedToken,
         sell_trade: schemas.TokenSwap,
@@ -37,9 +57,9 @@ class TraderProfitCalculator(TokenSwapProcessor):
             )
             token_sold.amount = amount_sold
         buy_price_usd = open_trade.average_buy_price_usd
-        buy_value_usd = amount_sold * buy_price_usd
-        sell_value_usd = amount_sold * sell_price_usd
-        profit_usd = sell_value_usd - buy_value_usd  # TODO add fees
+        buy_value_usd, sell_value_usd, profit_usd = cls._calculate_trade_values(
+            amount_sold, buy_price_usd, sell_price_usd
+        )
         return schemas.FinishedTrade(
             token_bought=open_trade.token_bought,
             buy_price_usd=buy_price_usd,
@@ -55,33 +75,37 @@ class TraderProfitCalculator(TokenSwapProcessor):
     def _adjust_bought_token(
         self, bought_token: schemas.BoughtToken, new_token_sold: schemas.TradedToken
     ) -> None:
-        adjusted_bought_token = dataclasses.replace(bought_token)
-        bought_token_address = bought_token.token_bought.address
         assert new_token_sold.amount <= bought_token.currently_held_amount
         new_token_amount = bought_token.currently_held_amount - new_token_sold.amount
-        adjusted_bought_token.currently_held_amount = new_token_amount
         if new_token_amount > 0:
-            self._bought_tokens[bought_token_address] = adjusted_bought_token
+            bought_token.currently_held_amount = new_token_amount
         else:
-            del self._bought_tokens[bought_token_address]
+            del self._bought_tokens[bought_token.token_bought.address]
+
+    def _close_bought_token(
+        self,
+        bought_token: schemas.BoughtToken,
+        token_sold: schemas.TradedToken,
+        sell_trade: schemas.TokenSwap,
+    ) -> schemas.FinishedTrade:
+        finished_trade = self._create_finished_trade(
+            bought_token, token_sold, sell_trade
+        )
+        self._adjust_bought_token(bought_token, token_sold)
+        return finished_trade
 
     def _check_closing_trade(
         self, new_trade: schemas.TokenSwap
     ) -> schemas.FinishedTrade | None:
         new_tokens_sold = new_trade.sold_tokens
         for new_token_sold in new_tokens_sold:
-            for token_address, bought_token in self._bought_tokens.items():
-                if new_token_sold.address == token_address:
-                    finished_trade = self._create_finished_trade(
-                        bought_token, new_token_sold, new_trade
-                    )
-                    self._adjust_bought_token(bought_token, new_token_sold)
-                    return finished_trade
+            bought_token = self._bought_tokens.get(new_token_sold.address)
+            if bought_token is not None:
+                return self._close_bought_token(bought_token, new_token_sold, new_trade)
         return None
 
-    @classmethod
+    @staticmethod
     def _calculate_new_average_price(
-        cls,
         current_amount: float,
         current_price: float,
         new_amount: float,
@@ -92,23 +116,21 @@ class TraderProfitCalculator(TokenSwapProcessor):
         )
 
     def _extend_bought_token(
-        self, new_single_token_buy: schemas.SingleTokenBuy
+        self,
+        current_bought_token: schemas.BoughtToken,
+        new_single_token_buy: schemas.SingleTokenBuy,
     ) -> None:
-        token_address = new_single_token_buy.token_bought.address
-        current_bought_token = self._bought_tokens[token_address]
-        new_quantity = (
-            current_bought_token.currently_held_amount
-            + new_single_token_buy.bought_token_amount
-        )
+        held_amount = current_bought_token.currently_held_amount
+        bought_amount = new_single_token_buy.bought_token_amount
         new_average_price = self._calculate_new_average_price(
-            current_bought_token.currently_held_amount,
+            held_amount,
             current_bought_token.average_buy_price_usd,
-            new_single_token_buy.bought_token_amount,
+            bought_amount,
             new_single_token_buy.buy_price_usd,
         )
         current_bought_token.single_token_buys.append(new_single_token_buy)
         current_bought_token.average_buy_price_usd = new_average_price
-        current_bought_token.currently_held_amount = new_quantity
+        current_bought_token.currently_held_amount = held_amount + bought_amount
 
     def _create_bought_token(
         self, new_single_token_buy: schemas.SingleTokenBuy
@@ -120,23 +142,55 @@ class TraderProfitCalculator(TokenSwapProcessor):
             single_token_buys=[new_single_token_buy],
         )
 
+    def _add_single_token_buy(
+        self, new_single_token_buy: schemas.SingleTokenBuy
+    ) -> None:
+        token_bought_address = new_single_token_buy.token_bought.address
+        current_bought_token = self._bought_tokens.get(token_bought_address)
+        if current_bought_token is not None:
+            self._extend_bought_token(current_bought_token, new_single_token_buy)
+        else:
+            self._bought_tokens[token_bought_address] = self._create_bought_token(
+                new_single_token_buy
+            )
+
+    def _receive_token_pair_swap(self, token_swap: schemas.TokenSwap) -> None:
+        """
+        Most swaps trade one token for another, handles them without building
+        intermediate lists for the swapped tokens
+        """
+        token_sold = token_swap.sold_tokens[0]
+        bought_token = self._bought_tokens.get(token_sold.address)
+        if bought_token is not None:
+            self._finished_trades.append(
+                self._close_bought_token(bought_token, token_sold, token_swap)
+            )
+            return
+        token_bought = token_swap.bought_tokens[0]
+        if token_bought.symbol in IGNORED_BUY_TOKEN_SYMBOLS:
+            return
+        new_single_token_buy = self._create_single_token_buy(
+            token_swap,
+            token_bought,
+            token_swap.transaction_hash,
+            [token_sold.value_usd],
+        )
+        if new_single_token_buy is not None:
+            self._add_single_token_buy(new_single_token_buy)
+
     def receive_token_swap(self, token_swap: schemas.TokenSwap) -> None:
+        if len(token_swap.sold_tokens) == 1 and len(token_swap.bought_tokens) == 1:
+            self._receive_token_pair_swap(token_swap)
+            return
         finished_trade = self._check_closing_trade(token_swap)
         if finished_trade:
             self._finished_trades.append(finished_trade)
         else:
-            new_single_token_buys = (
-                TraderProfitCalculator._convert_token_swap_to_single_token_buy(
-                    token_swap
-                )
+            new_single_token_buys = self._convert_token_swap_to_single_token_buy(
+                token_swap
             )
             for new_single_token_buy in new_single_token_buys:
-                token_bought_address = new_single_token_buy.token_bought.address
-                if token_bought_address in self._bought_tokens:
-                    self._extend_bought_token(new_single_token_buy)
-                else:
-                    new_bought_token = self._create_bought_token(new_single_token_buy)
-                    self._bought_tokens[token_bought_address] = new_bought_token
+                self._add_single_token_buy(new_single_token_buy)
 
     @staticmethod
     def _are_numbers_equal(
@@ -150,8 +204,24 @@ class TraderProfitCalculator(TokenSwapProcessor):
         """
         div_num_1 = num_1 / diff_divider
         div_num_2 = num_2 / diff_divider
-        max_difference = sum([div_num_1, div_num_2]) / 2.0
-        return abs(div_num_1 - div_num_2) < max_difference
+        return abs(div_num_1 - div_num_2) < (div_num_1 + div_num_2) / 2.0
+
+    @classmethod
+    def _has_equal_number(cls, sorted_numbers: list[float], number: float) -> bool:
+        """
+        :param sorted_numbers: ascending numbers to search in
+        :param number: number to find an equal one for
+        :return: whether any of sorted numbers is close enough to number
+        """
+        # numbers close enough form an interval around number,
+        # so it's enough to check the closest number on both sides
+        are_numbers_equal = cls._are_numbers_equal
+        index = bisect.bisect_left(sorted_numbers, number)
+        if index < len(sorted_numbers) and are_numbers_equal(
+            number, sorted_numbers[index]
+        ):
+            return True
+        return index > 0 and are_numbers_equal(number, sorted_numbers[index - 1])
 
     @classmethod
     def _create_single_token_buy(
@@ -159,48 +229,46 @@ class TraderProfitCalculator(TokenSwapProcessor):
         token_swap: schemas.TokenSwap,
         bought_token: schemas.TradedToken,
         transaction_hash: str,
-    ) -> schemas.SingleTokenBuy:
-        for token_paid in token_swap.sold_tokens:
-            if cls._are_numbers_equal(bought_token.value_usd, token_paid.value_usd):
-                bought_token_price = bought_token.value_usd / bought_token.amount
-                return schemas.SingleTokenBuy(
-                    buy_time=token_swap.time,
-                    buy_price_usd=bought_token_price,
-                    bought_token_amount=bought_token.amount,
-                    transaction_hash=transaction_hash,
-                    value_usd=bought_token.value_usd,
-                    token_bought=bought_token,
-                )
-        raise exceptions.UnassignedTradedTokenError()
-
-    @classmethod
-    def _filter_out_ignored_token_trades(
-        cls, new_open_trades: list[schemas.SingleTokenBuy]
-    ) -> list[schemas.SingleTokenBuy]:
-        return [
-            trade
-            for trade in new_open_trades
-            if trade.token_bought.symbol not in IGNORED_BUY_TOKEN_SYMBOLS
-        ]
+        sorted_sold_values_usd: list[float],
+    ) -> schemas.SingleTokenBuy | None:
+        if not cls._has_equal_number(sorted_sold_values_usd, bought_token.value_usd):
+            log.warning(
+                "Could not assign bought %s in token swap %s",
+                bought_token.symbol,
+                transaction_hash,
+            )
+            return None
+        return schemas.SingleTokenBuy(
+            buy_time=token_swap.time,
+            buy_price_usd=bought_token.price_usd,
+            bought_token_amount=bought_token.amount,
+            transaction_hash=transaction_hash,
+            value_usd=bought_token.value_usd,
+            token_bought=bought_token,
+        )
 
     @classmethod
     def _convert_token_swap_to_single_token_buy(
         cls, token_swap: schemas.TokenSwap
     ) -> list[schemas.SingleTokenBuy]:
         new_single_token_buys: list[schemas.SingleTokenBuy] = []
+        sorted_sold_values_usd = sorted(
+            token_sold.value_usd for token_sold in token_swap.sold_tokens
+        )
+        create_single_token_buy = cls._create_single_token_buy
         for bought_token in token_swap.bought_tokens:
-            try:
-                single_token_buy = cls._create_single_token_buy(
-                    token_swap, bought_token, token_swap.transaction_hash
-                )
-            except exceptions.UnassignedTradedTokenError as e:
-                log.warning(f"Could not assign one token in token swap, {e}")
+            if bought_token.symbol in IGNORED_BUY_TOKEN_SYMBOLS:
+                continue
+            single_token_buy = create_single_token_buy(
+                token_swap,
+                bought_token,
+                token_swap.transaction_hash,
+                sorted_sold_values_usd,
+            )
+            if single_token_buy is None:
                 continue
             new_single_token_buys.append(single_token_buy)
-        filtered_new_single_token_buys = cls._filter_out_ignored_token_trades(
-            new_single_token_buys
-        )
-        return filtered_new_single_token_buys
+        return new_single_token_buys
 
     @property
     def finished_trades(self) -> list[schemas.FinishedTrade]:
@@ -11,6 +11,9 @@ DEFAULT_TEST_ADDRESS = Web3.toChecksumAddress(
 SECOND_TEST_ADDRESS = Web3.toChecksumAddress(
     "0x1111111111111111111111111111111111111111"
 )
+THIRD_TEST_ADDRESS = Web3.toChecksumAddress(
+    "0x2222222222222222222222222222222222222222"
+)
 
 
 def create_coin_swap_trade(
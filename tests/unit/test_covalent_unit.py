@@ -0,0 +1,67 @@
+from typing import Any
+
+import pytest
+
+from tests import trade_utils
+
+pytest.importorskip("crypto_utils")
+from src import covalent  # noqa: E402
+
+
+def create_transactions_page(
+    item_count: int, has_more: bool, total_count: int | None = None
+) -> dict[str, Any]:
+    return {
+        "data": {
+            "items": [{"tx_hash": "0x123456"}] * item_count,
+            "pagination": {"has_more": has_more, "total_count": total_count},
+        }
+    }
+
+
+def stub_request_transactions(
+    monkeypatch: pytest.MonkeyPatch, pages: dict[int, dict[str, Any]]
+) -> list[int]:
+    requested_pages: list[int] = []
+
+    def request_transactions(
+        address: str, page_size: int = 10, page: int = covalent.FIRST_PAGE
+    ) -> dict[str, Any]:
+        requested_pages.append(page)
+        return pages[page]
+
+    monkeypatch.setattr(
+        covalent.Covalent, "request_transactions", staticmethod(request_transactions)
+    )
+    return requested_pages
+
+
+def test_requesting_all_pages_of_total_count(monkeypatch: pytest.MonkeyPatch) -> None:
+    pages = {
+        0: create_transactions_page(1000, has_more=True, total_count=2500),
+        1: create_transactions_page(1000, has_more=True, total_count=2500),
+        2: create_transactions_page(500, has_more=False, total_count=2500),
+    }
+    requested_pages = stub_request_transactions(monkeypatch, pages)
+    transactions_pages = list(
+        covalent.Covalent.request_all_transactions(
+            trade_utils.DEFAULT_TEST_ADDRESS, page_size=1000
+        )
+    )
+    assert sorted(requested_pages) == [0, 1, 2]
+    assert transactions_pages == [pages[0], pages[1], pages[2]]
+
+
+def test_requesting_pages_until_empty_page(monkeypatch: pytest.MonkeyPatch) -> None:
+    pages = {
+        0: create_transactions_page(1000, has_more=True),
+        1: create_transactions_page(0, has_more=True),
+    }
+    requested_pages = stub_request_transactions(monkeypatch, pages)
+    transactions_pages = list(
+        covalent.Covalent.request_all_transactions(
+            trade_utils.DEFAULT_TEST_ADDRESS, page_size=1000
+        )
+    )
+    assert requested_pages == [0, 1]
+    assert transactions_pages == [pages[0]]
@@ -0,0 +1,32 @@
+import pathlib
+
+from src import erc20_metadata_cache, schemas
+from tests import trade_utils
+
+
+def test_metadata_persisted_between_caches(tmp_path: pathlib.Path) -> None:
+    cache_path = str(tmp_path / "erc20_metadata.sqlite3")
+    metadata = schemas.Erc20Metadata(symbol="SPEX", decimals=18)
+    cache = erc20_metadata_cache.Erc20MetadataCache(cache_path)
+    assert cache.get(trade_utils.DEFAULT_TEST_ADDRESS) is None
+    cache.set(trade_utils.DEFAULT_TEST_ADDRESS, metadata)
+    reopened_cache = erc20_metadata_cache.Erc20MetadataCache(cache_path)
+    assert reopened_cache.get(trade_utils.DEFAULT_TEST_ADDRESS) == metadata
+    assert reopened_cache.get(trade_utils.SECOND_TEST_ADDRESS) is None
+
+
+def test_set_missing_keeps_cached_metadata(tmp_path: pathlib.Path) -> None:
+    cache = erc20_metadata_cache.Erc20MetadataCache(
+        str(tmp_path / "erc20_metadata.sqlite3")
+    )
+    cached_metadata = schemas.Erc20Metadata(symbol="SPEX", decimals=18)
+    new_metadata = schemas.Erc20Metadata(symbol="USDT", decimals=6)
+    cache.set(trade_utils.DEFAULT_TEST_ADDRESS, cached_metadata)
+    cache.set_missing(
+        [
+            (trade_utils.DEFAULT_TEST_ADDRESS, new_metadata),
+            (trade_utils.SECOND_TEST_ADDRESS, new_metadata),
+        ]
+    )
+    assert cache.get(trade_utils.DEFAULT_TEST_ADDRESS) == cached_metadata
+    assert cache.get(trade_utils.SECOND_TEST_ADDRESS) == new_metadata
@@ -103,3 +103,97 @@ def test_exiting_more_than_we_opened(
     finished_trade = profit_calculator.finished_trades[0]
     assert finished_trade.sell_value_usd == 100.0
     assert finished_trade.profit_usd == 0.0
+
+
+def test_receiving_token_swaps_in_batch(
+    profit_calculator: trade_processing.TraderProfitCalculator,
+) -> None:
+    profit_calculator.receive_token_swaps(
+        [
+            create_buying_trade(100.0, tokens_bought=1.0),
+            create_buying_trade(120.0, tokens_bought=1.0),
+            create_sell_trade(130.0, tokens_sold=1.0),
+        ]
+    )
+    spex_open_trade = profit_calculator.bought_tokens[trade_utils.DEFAULT_TEST_ADDRESS]
+    assert spex_open_trade.currently_held_amount == 1.0
+    finished_trade = profit_calculator.finished_trades[0]
+    assert finished_trade.buy_price_usd == pytest.approx(110.0)
+    assert finished_trade.profit_usd == pytest.approx(20.0)
+
+
+def test_buying_multiple_tokens_in_one_swap(
+    profit_calculator: trade_processing.TraderProfitCalculator,
+) -> None:
+    bought_spex = trade_utils.create_token(
+        symbol="SPEX", address=trade_utils.DEFAULT_TEST_ADDRESS, value_usd=100.0
+    )
+    bought_bao = trade_utils.create_token(
+        symbol="BAO", address=trade_utils.THIRD_TEST_ADDRESS, value_usd=50.0
+    )
+    paid_usdt = trade_utils.create_token(
+        symbol="USDT",
+        address=trade_utils.SECOND_TEST_ADDRESS,
+        amount=150.0,
+        value_usd=150.0,
+    )
+    paid_dai = trade_utils.create_token(
+        symbol="DAI",
+        address=trade_utils.SECOND_TEST_ADDRESS,
+        amount=50.0,
+        value_usd=50.0,
+    )
+    profit_calculator.receive_token_swap(
+        trade_utils.create_coin_swap_trade(
+            usd_paid=200.0,
+            usd_received=150.0,
+            sold_tokens=[paid_usdt, paid_dai],
+            bought_tokens=[bought_spex, bought_bao],
+            transaction_hash="0x123456",
+        )
+    )
+    bought_tokens = profit_calculator.bought_tokens
+    assert (
+        bought_tokens[trade_utils.DEFAULT_TEST_ADDRESS].average_buy_price_usd == 100.0
+    )
+    assert bought_tokens[trade_utils.THIRD_TEST_ADDRESS].average_buy_price_usd == 50.0
+
+
+def test_not_opening_trade_for_unassigned_token(
+    profit_calculator: trade_processing.TraderProfitCalculator,
+) -> None:
+    bought_spex = trade_utils.create_token(
+        symbol="SPEX", address=trade_utils.DEFAULT_TEST_ADDRESS, value_usd=500.0
+    )
+    paid_usdt = trade_utils.create_token(
+        symbol="USDT",
+        address=trade_utils.SECOND_TEST_ADDRESS,
+        amount=100.0,
+        value_usd=100.0,
+    )
+    profit_calculator.receive_token_swap(
+        trade_utils.create_coin_swap_trade(
+            usd_paid=100.0,
+            usd_received=500.0,
+            sold_tokens=[paid_usdt],
+            bought_tokens=[bought_spex],
+            transaction_hash="0x123456",
+        )
+    )
+    assert not profit_calculator.bought_tokens
+
+
+def test_reopening_trade_after_exiting_in_parts(
+    profit_calculator: trade_processing.TraderProfitCalculator,
+) -> None:
+    profit_calculator.receive_token_swap(create_buying_trade(100.0, tokens_bought=1.0))
+    profit_calculator.receive_token_swap(create_sell_trade(60.0, tokens_sold=0.5))
+    profit_calculator.receive_token_swap(create_sell_trade(60.0, tokens_sold=0.5))
+    assert trade_utils.DEFAULT_TEST_ADDRESS not in profit_calculator.bought_tokens
+    profit_calculator.receive_token_swap(create_buying_trade(200.0, tokens_bought=1.0))
+    profit_calculator.receive_token_swap(create_sell_trade(250.0, tokens_sold=1.0))
+    finished_trades = profit_calculator.finished_trades
+    assert [trade.profit_usd for trade in finished_trades] == pytest.approx(
+        [10.0, 10.0, 50.0]
+    )
+    assert finished_trades[-1].buy_price_usd == 200.0